@@ -1,32 +1,69 @@
-from flask import Flask, request, jsonify, Response, redirect
-from datetime import datetime, timedelta
+from flask import Flask, request, jsonify, Response, redirect, stream_with_context
+from datetime import date, datetime, timedelta
 from ryanair.ryanair import Ryanair
 from flask_cors import CORS
-import json
-import time
-import traceback
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wsgi import ClosingIterator
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from threading import Condition, Lock, RLock
+from collections import Counter
+from time import time
+from uuid import uuid4
+import requests
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+import orjson
+import redis
+import heapq
+from itertools import islice
+import zlib
 from os import environ
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits import parse as parse_limit
 import re
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+import atexit
 from enum import Enum
+from dataclasses import dataclass
+from functools import lru_cache
+from operator import attrgetter
 from typing import Optional
-from ryanair.airport_utils import convert_local_to_utc, get_airport_by_iata, load_airports
+from ryanair.airport_utils import convert_local_to_utc, get_airport_by_iata, load_airports, load_ryanair_airports
 
 
 app = Flask(__name__)
+# Behind a reverse proxy the client address is in X-Forwarded-For rather than
+# the peer address. Only trusted when PROXY_FIX_X_FOR says how many proxies
+# append to the header; trusting more would let clients pick their own address
+if environ.get('PROXY_FIX_X_FOR'):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(environ['PROXY_FIX_X_FOR']))
 
 # Setup Flask application with logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[
-        RotatingFileHandler('api.log', maxBytes=100000, backupCount=3),
+# Request threads only put records on a queue; a background listener does the
+# file/console I/O and rotation so they never block the SSE stream.
+# Guarded so a second import of this module (e.g. as __main__ and as app)
+# doesn't open another handle on api.log
+if not logging.getLogger().handlers:
+    log_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    log_handlers = [
+        RotatingFileHandler('api.log', maxBytes=5_000_000, backupCount=3),
         logging.StreamHandler()
-    ],
-    format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-)
+    ]
+    for handler in log_handlers:
+        handler.setFormatter(log_formatter)
+
+    log_queue = queue.Queue(-1)
+    log_listener = QueueListener(log_queue, *log_handlers)
+    log_listener.start()
+    # Flush whatever is still queued when the worker exits
+    atexit.register(log_listener.stop)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
 
 logger = logging.getLogger(__name__)
 
@@ -44,32 +81,494 @@ CORS(app,
      })
 
 # Configure rate limiting to prevent API abuse
+# RATELIMIT_STORAGE_URI should point at Redis (redis://host:port) when running
+# several Gunicorn workers so they share counters; defaults to in-process memory
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    default_limits=["400 per day", "100 per hour"]
+    default_limits=["400 per day", "100 per hour"],
+    storage_uri=environ.get('RATELIMIT_STORAGE_URI', 'memory://'),
+    strategy='moving-window'
+)
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD cap on the number of Ryanair calls in flight
+    
+    The limit is halved whenever Ryanair throttles us (HTTP 429 or 5xx) and
+    grows by one after each full window of successful calls, up to maximum.
+    """
+
+    def __init__(self, initial: int, maximum: int, minimum: int = 1):
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self._successes = 0
+                logger.warning("Ryanair is throttling, concurrency limit lowered to %d", self.limit)
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+def is_throttling_error(error: Exception) -> bool:
+    """Check if an API error means Ryanair wants us to slow down"""
+    if not isinstance(error, requests.HTTPError) or error.response is None:
+        return False
+    status = error.response.status_code
+    return status == 429 or status >= 500
+
+class StreamLimit:
+    """
+    Cap on the number of SSE searches a single client can have open at once
+    
+    Every open stream holds a slot until the response is closed. With a Redis
+    storage URI the slots live in one sorted set per client, so the cap holds
+    across Gunicorn workers; otherwise they are counted in this process.
+    Redis slots expire after ttl seconds in case a worker dies without
+    releasing them.
+    """
+
+    # Drop expired slots, then take one only if the client is under the cap
+    ACQUIRE_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1] - ARGV[3])
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+        return 0
+    end
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+    """
+
+    def __init__(self, maximum: int, storage_uri: str, ttl: int = 600):
+        self.maximum = maximum
+        self.ttl = ttl
+        self._redis = None
+        if storage_uri.startswith(('redis://', 'rediss://')):
+            self._redis = redis.Redis.from_url(storage_uri)
+            self._acquire_script = self._redis.register_script(self.ACQUIRE_SCRIPT)
+        self._open = Counter()
+        self._lock = Lock()
+
+    def acquire(self, client: str) -> Optional[str]:
+        """
+        Take a stream slot for a client
+        
+        Args:
+            client: Key identifying the client, e.g. its remote address
+        
+        Returns:
+            Optional[str]: Slot token to pass to release, or None if the client
+                already has the maximum number of streams open
+        """
+        token = uuid4().hex
+        if self._redis is not None:
+            taken = self._acquire_script(
+                keys=[f"streams:{client}"],
+                args=[time(), token, self.ttl, self.maximum]
+            )
+            return token if taken else None
+
+        with self._lock:
+            if self._open[client] >= self.maximum:
+                return None
+            self._open[client] += 1
+        return token
+
+    def release(self, client: str, token: str):
+        """Give back a slot taken by acquire"""
+        if self._redis is not None:
+            self._redis.zrem(f"streams:{client}", token)
+            return
+
+        with self._lock:
+            self._open[client] -= 1
+            if self._open[client] <= 0:
+                del self._open[client]
+
+# Shared pool for Ryanair API calls; the lookups are network-bound so threads
+# spend nearly all their time blocked on sockets
+EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+# Most lookups one search keeps queued or running on EXECUTOR, so concurrent
+# searches share the pool instead of waiting behind each other's whole fan-out
+LOOKUPS_PER_SEARCH = 8
+
+# Calls actually sent to Ryanair are additionally gated by an AIMD limit so a
+# throttling upstream gets fewer parallel requests instead of more retries
+RYANAIR_CONCURRENCY = AdaptiveConcurrencyLimit(initial=8, maximum=16)
+
+# Short-lived cache of raw Ryanair results shared by all searches; fares
+# barely move within five minutes and popular routes get searched repeatedly
+TRIP_CACHE = TTLCache(maxsize=4096, ttl=300)
+TRIP_CACHE_LOCK = RLock()
+
+# Airport coordinates and timezones, loaded at startup
+load_airports()
+
+# IATA codes of every airport Ryanair flies from, bundled with the client
+VALID_AIRPORT_CODES = frozenset(load_ryanair_airports())
+
+# Country names in airports.json that differ from the ones Ryanair displays
+# (and the frontend sends), mapped to Ryanair's spelling
+COUNTRY_NAME_ALIASES = {
+    'Bosnia and Herzegovina': 'Bosnia & Herzegovina',
+}
+
+# Airports airports.json files under another country than Ryanair shows them in
+AIRPORT_COUNTRY_OVERRIDES = {
+    'VIL': 'Morocco',
+}
+
+# The same airports grouped by country name, so a country selection turns
+# into one set of destination codes
+AIRPORTS_BY_COUNTRY = {}
+for code, airport in load_ryanair_airports().items():
+    country = AIRPORT_COUNTRY_OVERRIDES.get(code) or COUNTRY_NAME_ALIASES.get(airport['country'], airport['country'])
+    AIRPORTS_BY_COUNTRY.setdefault(country, set()).add(code)
+
+# Long-lived SSE streams are not covered by the request-count limits above,
+# so also cap how many searches one client can have streaming in parallel
+STREAM_LIMIT = StreamLimit(
+    maximum=int(environ.get('MAX_STREAMS_PER_CLIENT', '4')),
+    storage_uri=environ.get('RATELIMIT_STORAGE_URI', 'memory://')
 )
 
+# Sort keys for flights and return trips
+by_price = attrgetter('price')
+by_total_price = attrgetter('totalPrice')
+
+# Pre-encoded server-sent event framing
+SSE_DATA_PREFIX = b"data: "
+SSE_EVENT_SUFFIX = b"\n\n"
+SSE_END_EVENT = b"data: END\n\n"
+
+# Quota on results streamed to one client; a search is charged every
+# SSE_QUOTA_BATCH events so a long fan-out stops once the client is over it
+SSE_EVENT_LIMIT = parse_limit(environ.get('SSE_EVENT_LIMIT', '20000 per hour'))
+SSE_QUOTA_BATCH = 100
+
 # Validation helper functions
 @app.route('/search-flights', methods=['GET', 'OPTIONS'])
 def redirect_search():
     return redirect(f"/api{request.full_path}", code=307)
 
-def validate_date_format(date_str):
-    """Validate if a string matches YYYY-MM-DD format"""
+def validate_date_format(date_str) -> Optional[datetime]:
+    """Parse a YYYY-MM-DD string, returning None if it isn't a valid date in that format"""
+    # fromisoformat also accepts other ISO forms (20230820, times), so pin the shape first
+    if not date_str or len(date_str) != 10 or date_str[4] != '-' or date_str[7] != '-':
+        return None
     try:
-        return bool(datetime.strptime(date_str, '%Y-%m-%d'))
+        return datetime.fromisoformat(date_str)
     except ValueError:
-        return False
+        return None
 
 def validate_airport_code(code):
-    """Validate if a string is a valid 3-letter airport code"""
-    return bool(re.match(r'^[A-Z]{3}$', code))
+    """Validate if a string is the 3-letter code of an airport served by Ryanair"""
+    # A set lookup both checks the format and rejects airports we can't search from
+    return code in VALID_AIRPORT_CODES
+
+# Trip types the search endpoint understands
+TRIP_TYPES = frozenset(('oneWay', 'return', 'weekend', 'longWeekend'))
+
+@dataclass(frozen=True)
+class SearchParams:
+    """Validated query parameters of a flight search"""
+    trip_type: str
+    start_date: datetime
+    end_date: datetime
+    max_price: float
+    min_days: int
+    max_days: int
+    origin_airports: list
+    wanted_countries: list
+    adults: int
+    teens: int
+    children: int
+    limit: Optional[int] = None
+
+# Query arguments a flight search reads
+SEARCH_ARGS = (
+    'originAirports', 'tripType', 'startDate', 'endDate', 'maxPrice', 'wantedCountries',
+    'adults', 'teens', 'children', 'minDays', 'maxDays', 'limit'
+)
+
+def split_list_arg(value):
+    """Split a comma-separated query argument, dropping empty items"""
+    return [item for item in (value or '').split(',') if item]
+
+def parse_search_params(args) -> SearchParams:
+    """
+    Validate the query string of a flight search and convert it to typed values
+    
+    Args:
+        args: Query arguments of the request
+    
+    Returns:
+        SearchParams: Parsed search parameters
+    
+    Raises:
+        ValueError: With a message for the client when a parameter is missing or invalid
+    """
+    # Read each argument once; the presence checks and the parsing use the same value
+    raw = {field: args.get(field) for field in SEARCH_ARGS}
+
+    # Reject searches without origins before doing any other parsing
+    origin_airports = split_list_arg(raw['originAirports'])
+    if not origin_airports:
+        raise ValueError('Missing required field: originAirports')
+
+    trip_type = raw['tripType']
+    required_fields = ['tripType', 'startDate', 'maxPrice', 'wantedCountries', 'adults']
+    if trip_type != 'oneWay':
+        required_fields.extend(['endDate', 'minDays', 'maxDays'])
+
+    for field in required_fields:
+        if not raw[field]:
+            raise ValueError(f'Missing required field: {field}')
+
+    if trip_type not in TRIP_TYPES:
+        raise ValueError('Invalid trip type')
+
+    start_date_raw = raw['startDate']
+    # One-way searches without an end date only look at the start date
+    end_date_raw = raw['endDate'] or start_date_raw
+    start_date = validate_date_format(start_date_raw)
+    end_date = validate_date_format(end_date_raw)
+    if start_date is None or end_date is None:
+        raise ValueError('Invalid date format')
+
+    if not all(validate_airport_code(code) for code in origin_airports):
+        raise ValueError('Invalid airport code')
+
+    try:
+        max_price = float(raw['maxPrice'])
+        adults = int(raw['adults'])
+        teens = int(raw['teens'] or 0)
+        children = int(raw['children'] or 0)
+        min_days = int(raw['minDays'] or 0)
+        max_days = int(raw['maxDays'] or 0)
+        limit = int(raw['limit']) if raw['limit'] else None
+    except ValueError:
+        raise ValueError('Invalid numeric values') from None
+
+    if max_price < 0 or adults < 1 or teens < 0 or children < 0 or min_days < 0 or max_days < 0:
+        raise ValueError('Invalid numeric values')
+
+    if limit is not None and limit < 1:
+        raise ValueError('Invalid numeric values')
+
+    wanted_countries = split_list_arg(raw['wantedCountries'])
+    if not wanted_countries:
+        raise ValueError('Origin airports and wanted countries cannot be empty')
+
+    return SearchParams(
+        trip_type=trip_type,
+        start_date=start_date,
+        end_date=end_date,
+        max_price=max_price,
+        min_days=min_days,
+        max_days=max_days,
+        origin_airports=origin_airports,
+        wanted_countries=wanted_countries,
+        adults=adults,
+        teens=teens,
+        children=children,
+        limit=limit
+    )
+
+def compile_country_pattern(countries):
+    """Build a single regex that matches any of the given country names"""
+    return re.compile('|'.join(re.escape(country) for country in countries))
+
+@lru_cache(maxsize=128)
+def build_country_filter(countries: tuple):
+    """
+    Build a predicate checking whether an airport is in one of the wanted countries
+    
+    The wanted countries are expanded once into the set of their airport
+    codes, so most destinations are accepted with a single set lookup. The
+    bundled list doesn't always file an airport under the country Ryanair
+    shows for it, so a miss there is never final: the Ryanair full name,
+    which looks like "<airport>, <country>", is checked too, or searched for
+    any wanted country when it has no such separator. Filters are cached,
+    since the frontend keeps sending the same country selections.
+    
+    Args:
+        countries: Wanted country names, as a tuple so it can be cached
+    
+    Returns:
+        Callable taking an airport code and full name and returning True on a match
+    """
+    wanted = frozenset(countries)
+    wanted_codes = frozenset().union(*(
+        AIRPORTS_BY_COUNTRY.get(COUNTRY_NAME_ALIASES.get(country, country), ())
+        for country in countries
+    ))
+    pattern = compile_country_pattern(countries)
+
+    def matches(airport_code, full_name):
+        if airport_code in wanted_codes:
+            return True
+        _, separator, country = full_name.rpartition(', ')
+        if separator:
+            return country in wanted
+        return pattern.search(full_name) is not None
+
+    return matches
+
+def flight_key(flight) -> tuple:
+    """
+    Build a dedup key for a flight
+    
+    Args:
+        flight: Flight returned by the Ryanair client
+    
+    Returns:
+        tuple: Key that is unique per route and departure time
+    """
+    return (flight.origin, flight.destination, flight.departureTime)
+
+def return_trip_key(trip) -> tuple:
+    """Build a dedup key for a return trip from its two flights"""
+    return (flight_key(trip.outbound), flight_key(trip.inbound))
+
+@lru_cache(maxsize=None)
+def get_api(currency: str) -> Ryanair:
+    """
+    Return the shared Ryanair client for a currency
+    
+    The client is built on first use and kept for the life of the process,
+    so its requests.Session keeps pooled keep-alive connections to Ryanair
+    instead of paying a TCP+TLS handshake on every search.
+    """
+    return Ryanair(currency)
+
+def call_ryanair(fetch):
+    """
+    Run a Ryanair API call under the adaptive concurrency limit
+    
+    Args:
+        fetch: Zero-argument callable performing the API call
+    
+    Returns:
+        The result of fetch
+    """
+    RYANAIR_CONCURRENCY.acquire()
+    throttled = False
+    try:
+        return fetch()
+    except Exception as e:
+        throttled = is_throttling_error(e)
+        raise
+    finally:
+        RYANAIR_CONCURRENCY.release(throttled)
+
+@cached(TRIP_CACHE, key=lambda *args: hashkey('oneWay', *args), lock=TRIP_CACHE_LOCK)
+def cached_one_way_trips(origin_code: str, flight_date: date, adults: int, teens: int, children: int):
+    """
+    Fetch one-way fares departing on flight_date, cached for five minutes
+    
+    Ryanair only returns the cheapest fare per destination for the whole
+    window, so every day is queried on its own rather than as one range.
+    
+    The lock only guards cache access, so concurrent misses don't serialize
+    on the API call. Failed calls raise and are not cached.
+    """
+    return call_ryanair(lambda: get_api("EUR").get_cheapest_flights(
+        origin_code,
+        flight_date,
+        flight_date,
+        adult_count=adults,
+        teen_count=teens,
+        child_count=children
+    ))
+
+@cached(TRIP_CACHE, key=lambda *args: hashkey('return', *args), lock=TRIP_CACHE_LOCK)
+def cached_return_trips(origin_code: str, flight_date: date, return_date_from: date, return_date_to: date,
+                        adults: int, teens: int, children: int):
+    """Fetch return fares for one outbound day and an inbound window, cached for five minutes"""
+    return call_ryanair(lambda: get_api("EUR").get_cheapest_return_flights(
+        origin_code,
+        flight_date,
+        flight_date,
+        return_date_from,
+        return_date_to,
+        adult_count=adults,
+        teen_count=teens,
+        child_count=children
+    ))
+
+def merge_completed(fetch, lookups, key, in_flight):
+    """
+    Run a search's API lookups on the shared pool and yield their trips as they finish
+    
+    Only LOOKUPS_PER_SEARCH lookups are queued or running at once, and a new
+    one is submitted each time one completes. A long search therefore takes
+    turns on the pool with other searches instead of queuing all its lookups
+    ahead of theirs. Each lookup returns its trips already sorted, and lookups
+    that complete together are merged into one price-ordered run.
+    
+    Args:
+        fetch: Lookup run on the pool as fetch(origin_code, flight_date)
+        lookups: Iterable of (origin_code, flight_date) pairs to look up
+        key: Sort key shared by all lookup results
+        in_flight: Dict the pending futures are kept in, mapped to their origin
+            airport code, so the caller can cancel them
+    
+    Yields:
+        Iterator over the trips of each batch of completed lookups, in price order
+    """
+    lookups = iter(lookups)
+
+    def submit_next():
+        for origin_code, flight_date in islice(lookups, 1):
+            in_flight[EXECUTOR.submit(fetch, origin_code, flight_date)] = origin_code
+
+    for _ in range(LOOKUPS_PER_SEARCH):
+        submit_next()
+
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        batches = []
+        for future in done:
+            origin_code = in_flight.pop(future)
+            try:
+                batches.append(future.result())
+            except Exception as api_error:
+                logger.error(f"API Error for {origin_code}: {str(api_error)}", exc_info=True)
+            # Refill the window before the caller starts writing this batch out
+            submit_next()
+        yield heapq.merge(*batches, key=key)
 
 class WeekendMode(Enum):
     DEFAULT = "weekend"
     RELAXED = "longWeekend"
 
+# Bit n is set when weekday n (Monday is 0) is allowed for (mode, is_outbound)
+_WEEKEND_MASKS = {
+    (WeekendMode.DEFAULT, True): 0b0110000,   # Friday or Saturday departures
+    (WeekendMode.DEFAULT, False): 0b1100000,  # Saturday or Sunday returns
+    (WeekendMode.RELAXED, True): 0b0111000,   # Thursday to Saturday departures
+    (WeekendMode.RELAXED, False): 0b1000001,  # Sunday or Monday returns
+}
+
 def is_valid_weekend_day(date: datetime, mode: WeekendMode, is_outbound: bool) -> bool:
     """
     Check if a date is valid for weekend travel based on the mode and direction.
@@ -82,17 +581,7 @@ def is_valid_weekend_day(date: datetime, mode: WeekendMode, is_outbound: bool) -
     Returns:
         bool: True if date matches weekend criteria, False otherwise
     """
-    weekday = date.weekday()  # Monday is 0, Sunday is 6
-    
-    if mode == WeekendMode.DEFAULT:  # weekend
-        if is_outbound:
-            return weekday in [4, 5]  # Friday or Saturday departures
-        return weekday in [5, 6]      # Saturday or Sunday returns
-    
-    elif mode == WeekendMode.RELAXED:  # longWeekend
-        if is_outbound:
-            return weekday in [3, 4, 5]  # Thursday to Saturday departures
-        return weekday in [6, 0]         # Sunday or Monday returns
+    return bool((_WEEKEND_MASKS[(mode, is_outbound)] >> date.weekday()) & 1)
 
 def is_valid_weekend_trip(outbound_date: datetime, inbound_date: datetime, mode: WeekendMode) -> bool:
     """
@@ -122,9 +611,6 @@ def calculate_duration(departure_time: datetime, arrival_time: datetime, origin_
     Returns:
         int: Flight duration in minutes
     """
-    # Ensure airports are loaded
-    load_airports()
-    
     # Convert both times to UTC using the respective airport timezones
     departure_utc = convert_local_to_utc(departure_time.isoformat(), origin_airport)
     arrival_utc = convert_local_to_utc(arrival_time.isoformat(), destination_airport)
@@ -133,6 +619,136 @@ def calculate_duration(departure_time: datetime, arrival_time: datetime, origin_
     duration = int((arrival_utc - departure_utc).total_seconds() / 60)
     return duration
 
+def sse_event(payload) -> bytes:
+    """Encode a payload as one server-sent event"""
+    return b"".join((SSE_DATA_PREFIX, orjson.dumps(payload), SSE_EVENT_SUFFIX))
+
+# Sent when a search finishes without a single match; it never changes
+SSE_NO_FLIGHTS_EVENT = sse_event({
+    "type": "NO_FLIGHTS",
+    "message": "No flights found matching your criteria"
+})
+
+# Sent instead of further results once a client has used up its event quota
+SSE_RATE_LIMITED_EVENT = sse_event({
+    "type": "RATE_LIMITED",
+    "message": "Too many results requested, please try again later"
+})
+
+def consume_event_quota(client: str, sent: int) -> bool:
+    """
+    Charge streamed events against a client's SSE event quota
+    
+    Args:
+        client: Key identifying the client, e.g. its remote address
+        sent: Number of events sent since the last charge
+    
+    Returns:
+        bool: False once the client has run out of quota
+    """
+    if limiter.limiter.hit(SSE_EVENT_LIMIT, 'sse-events', client, cost=sent):
+        return True
+    # A charge that doesn't fit is dropped whole, so use up what is left
+    # instead; otherwise the client's next search would still be let in
+    remaining = limiter.limiter.get_window_stats(SSE_EVENT_LIMIT, 'sse-events', client).remaining
+    if remaining > 0:
+        limiter.limiter.hit(SSE_EVENT_LIMIT, 'sse-events', client, cost=remaining)
+    return False
+
+def gzip_stream(chunks):
+    """
+    Gzip a stream of SSE chunks without holding any of them back
+    
+    The compressor is sync-flushed after every chunk, so each write decodes
+    to whole events on the client instead of waiting for the stream to end.
+    
+    Args:
+        chunks: Iterator of encoded SSE chunks
+    
+    Returns:
+        Generator yielding the gzip stream
+    """
+    compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        # Stop the search as soon as the client goes away
+        chunks.close()
+
+def format_flight_data(trip, total_passengers: int) -> dict:
+    """
+    Build the SSE payload for a one-way flight
+    
+    Args:
+        trip: Flight returned by the Ryanair client
+        total_passengers: Number of passengers the price is multiplied by
+    
+    Returns:
+        dict: JSON-serializable flight event
+    """
+    return {
+        'outbound': {
+            'origin': trip.origin,
+            'originFull': trip.originFull,
+            'destination': trip.destination,
+            'destinationFull': trip.destinationFull,
+            'departureTime': trip.departureTime,
+        },
+        'inbound': {
+            'origin': trip.destination,
+            'originFull': trip.destinationFull,
+            'destination': trip.origin,
+            'destinationFull': trip.originFull,
+            'departureTime': trip.departureTime,
+        },
+        'totalPrice': trip.price * total_passengers
+    }
+
+def format_return_flight_data(trip, total_passengers: int) -> dict:
+    """
+    Build the SSE payload for a return trip
+    
+    Args:
+        trip: Trip returned by the Ryanair client
+        total_passengers: Number of passengers the price is multiplied by
+    
+    Returns:
+        dict: JSON-serializable trip event
+    """
+    ob = trip.outbound
+    ib = trip.inbound
+    return {
+        'outbound': {
+            'origin': ob.origin,
+            'originFull': ob.originFull,
+            'destination': ob.destination,
+            'destinationFull': ob.destinationFull,
+            'departureTime': ob.departureTime,
+            'arrivalTime': ob.arrivalTime,
+            'flightDuration': 0,
+            #'flightDuration': calculate_duration(ob.departureTime, ob.arrivalTime, ob.origin, ob.destination),
+            'flightNumber': ob.flightNumber,
+            'price': ob.price,
+            'currency': ob.currency,
+        },
+        'inbound': {
+            'origin': ib.origin,
+            'originFull': ib.originFull,
+            'destination': ib.destination,
+            'destinationFull': ib.destinationFull,
+            'departureTime': ib.departureTime,
+            'arrivalTime': ib.arrivalTime,
+            'flightDuration': 0,
+            #'flightDuration': calculate_duration(ib.departureTime, ib.arrivalTime, ib.origin, ib.destination),
+            'flightNumber': ib.flightNumber,
+            'price': ib.price,
+            'currency': ib.currency,
+        },
+        'totalPrice': trip.totalPrice * total_passengers
+    }
+
 @app.route('/api/search-flights', methods=['GET', 'OPTIONS'])
 @limiter.limit("30 per minute")
 def search_flights():
@@ -151,264 +767,175 @@ def search_flights():
         return response
 
     try:
-        # Validate dates
-        start_date = request.args.get('startDate')
-        end_date = request.args.get('endDate')
-        
-        if not validate_date_format(start_date) or \
-           (end_date and not validate_date_format(end_date)):
-            return jsonify({'error': 'Invalid date format'}), 400
+        try:
+            params = parse_search_params(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Validate airport codes
-        origin_airports = request.args.get('originAirports', '').split(',')
-        if not all(validate_airport_code(code) for code in origin_airports if code):
-            return jsonify({'error': 'Invalid airport code'}), 400
+        trip_type = params.trip_type
+        start_date, end_date = params.start_date, params.end_date
+        maximum_price = params.max_price
+        min_days, max_days = params.min_days, params.max_days
+        origin_codes = params.origin_airports
+        wanted_countries = params.wanted_countries
+        adults, teens, children = params.adults, params.teens, params.children
+        # Searches without a limit stream every match
+        result_limit = params.limit or float('inf')
 
-        # Validate numeric values
-        try:
-            max_price = float(request.args.get('maxPrice', 0))
-            adults = int(request.args.get('adults', 0))
-            teens = int(request.args.get('teens', 0))
-            children = int(request.args.get('children', 0))
-            
-            if max_price < 0 or adults < 1 or teens < 0 or children < 0:
-                raise ValueError
-        except ValueError:
-            return jsonify({'error': 'Invalid numeric values'}), 400
-
-        data = {
-            'tripType': request.args.get('tripType'),
-            'startDate': request.args.get('startDate'),
-            'endDate': request.args.get('endDate'),
-            'maxPrice': request.args.get('maxPrice'),
-            'minDays': request.args.get('minDays'),
-            'maxDays': request.args.get('maxDays'),
-            'originAirports': request.args.get('originAirports', '').split(','),
-            'wantedCountries': request.args.get('wantedCountries', '').split(','),
-            'adults': request.args.get('adults'),
-            'teens': request.args.get('teens'),
-            'children': request.args.get('children')
-        }
+        in_wanted_country = build_country_filter(tuple(wanted_countries))
+        
+        total_passengers = adults + teens + children  # maximum_price is the total for all of them
 
-        required_fields = ['tripType', 'startDate', 'maxPrice', 'originAirports', 'wantedCountries', 'adults', 'teens', 'children']
-        if data.get('tripType') == 'return':
-            required_fields.extend(['endDate', 'minDays', 'maxDays'])
+        # Log a single concise line for the search request
+        logger.info(f"Search request: {trip_type} from {','.join(origin_codes)} to {','.join(wanted_countries)} ({start_date} - {end_date})")
 
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Missing required field: {field}'}), 400
+        weekend_mode = None
+        if trip_type in ('weekend', 'longWeekend'):
+            weekend_mode = WeekendMode(trip_type)
 
-        # Process dates first
-        try:
-            start_date = datetime.strptime(data['startDate'], '%Y-%m-%d')
-            end_date = datetime.strptime(data['endDate'], '%Y-%m-%d')
-        except ValueError:
-            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        budget_per_seat = maximum_price / total_passengers
 
-        # Process numeric values
-        try:
-            maximum_price = float(data['maxPrice'])
-            min_days = int(data['minDays'])
-            max_days = int(data['maxDays'])
-        except ValueError:
-            return jsonify({'error': 'Invalid numeric value'}), 400
+        # Predicates for the trips worth sending to the client
+        def is_wanted_flight(trip, budget=budget_per_seat, in_country=in_wanted_country):
+            return trip.price <= budget and in_country(trip.destination, trip.destinationFull)
 
-        origin_codes = data['originAirports']
-        wanted_countries = data['wantedCountries']
+        def is_wanted_trip(trip, budget=budget_per_seat, in_country=in_wanted_country,
+                           mode=weekend_mode, last_day=end_date.date()):
+            return (trip.totalPrice <= budget
+                    and in_country(trip.outbound.destination, trip.outbound.destinationFull)
+                    and (not mode or 
+                         is_valid_weekend_trip(
+                             trip.outbound.departureTime,
+                             trip.inbound.departureTime,
+                             mode
+                         ))
+                    and trip.inbound.departureTime.date() <= last_day)
 
-        if not origin_codes or not wanted_countries:
-            return jsonify({'error': 'Origin airports and wanted countries cannot be empty'}), 400
-        
-        total_passengers = int(data['adults']) + int(data['teens']) + int(data['children'])
-        maximum_price = float(data['maxPrice'])  # Total price for all passengers
+        def fetch_one_way(origin_code, flight_date):
+            """Fetch one day of one-way fares, keeping matching trips sorted by price"""
+            trips = cached_one_way_trips(origin_code, flight_date.date(), adults, teens, children)
+            return sorted(filter(is_wanted_flight, trips), key=by_price)
 
-        # Log a single concise line for the search request
-        logger.info(f"Search request: {data['tripType']} from {','.join(origin_codes)} to {','.join(wanted_countries)} ({start_date} - {end_date})")
+        def fetch_return(origin_code, flight_date):
+            """Fetch return fares for one outbound day, keeping matching trips sorted by price"""
+            trips = cached_return_trips(
+                origin_code,
+                flight_date.date(),
+                (flight_date + timedelta(days=min_days)).date(),
+                min(end_date, flight_date + timedelta(days=max_days)).date(),
+                adults, teens, children
+            )
+            return sorted(filter(is_wanted_trip, trips), key=by_total_price)
+
+        client = get_remote_address()
 
-        api = Ryanair("EUR")
-        
         def generate_results():
             flights_found = False
+            # (date, origin) lookups run a window at a time and are handled in
+            # completion order, so rows stream out as soon as Ryanair answers.
+            # futures holds the ones in flight so they can be cancelled
+            futures = {}
+            unbilled_events = 0
+            # Once the client's limit is reached the remaining lookups are cancelled
+            remaining = result_limit
             
-            if data['tripType'] == 'oneWay':
-                seen_flights = set()
-                current_date = start_date
-                while current_date <= end_date:
-                    for origin_code in origin_codes:
-                        try:
-                            try:
-                                trips = api.get_cheapest_flights(
-                                    origin_code,
-                                    current_date,
-                                    current_date + timedelta(days=1),
-                                    adult_count=int(data['adults']),
-                                    teen_count=int(data['teens']),
-                                    child_count=int(data['children'])
-                                )
-                            except Exception as api_error:
-                                logger.error(f"API Error for {origin_code}: {str(api_error)}", exc_info=True)
-                                traceback.print_exc()
-                                continue
-
-                            if not trips:
-                                continue
-                            
-                            filtered_trips = [
-                                trip for trip in trips 
-                                if (trip.price * total_passengers) <= maximum_price 
-                                and any(country in trip.destinationFull for country in wanted_countries)
-                            ]
-                            
-                            if filtered_trips:
-                                flights_found = True
-                            
-                            for trip in sorted(filtered_trips, key=lambda x: x.price):
-                                # Create a unique identifier for the flight
-                                flight_id = f"{trip.origin}-{trip.destination}-{trip.departureTime.isoformat()}"
-                                
-                                # Skip if we've already seen this flight
-                                if flight_id in seen_flights:
-                                    continue
-                                    
-                                # Add to seen flights
-                                seen_flights.add(flight_id)
-                                
-                                time.sleep(0.01)
-                                flight_json = {
-                                    'outbound': {
-                                        'origin': trip.origin,
-                                        'originFull': trip.originFull,
-                                        'destination': trip.destination,
-                                        'destinationFull': trip.destinationFull,
-                                        'departureTime': trip.departureTime.isoformat(),
-                                    },
-                                    'inbound': {
-                                        'origin': trip.destination,
-                                        'originFull': trip.destinationFull,
-                                        'destination': trip.origin,
-                                        'destinationFull': trip.originFull,
-                                        'departureTime': trip.departureTime.isoformat(),
-                                    },
-                                    'totalPrice': trip.price * total_passengers
-                                }
-                                logger.info(f"Sending flight: {flight_json}")
-                                yield f"data: {json.dumps(flight_json)}\n\n"
-                        except Exception as e:
-                            logger.error(f"Error fetching flights for {origin_code}: {str(e)}", exc_info=True)
-                            traceback.print_exc()
+            try:
+                if trip_type == 'oneWay':
+                    flight_dates = [start_date + timedelta(days=offset)
+                                    for offset in range((end_date - start_date).days + 1)]
+                    lookups = ((origin_code, current_date)
+                               for current_date in flight_dates for origin_code in origin_codes)
+                    fetch, sort_key = fetch_one_way, by_price
+                    dedup_key, format_trip = flight_key, format_flight_data
+                else:  # return, weekend, or longWeekend flights
+                    # Calculate the latest possible outbound date
+                    # It should be end_date minus minimum trip duration
+                    latest_outbound_date = end_date - timedelta(days=min_days)
+                    
+                    # Non-weekend days are dropped up front for weekend trips
+                    candidate_dates = (start_date + timedelta(days=offset)
+                                       for offset in range((latest_outbound_date - start_date).days + 1))
+                    outbound_dates = [current_date for current_date in candidate_dates
+                                      if not weekend_mode or is_valid_weekend_day(current_date, weekend_mode, True)]
+
+                    lookups = ((origin_code, current_date)
+                               for current_date in outbound_dates for origin_code in origin_codes)
+                    fetch, sort_key = fetch_return, by_total_price
+                    dedup_key, format_trip = return_trip_key, format_return_flight_data
+
+                # Skip trips already sent for an overlapping query
+                seen_trips = set()
+                rate_limited = False
+
+                # Events from lookups that finish together go out in a single write
+                for batch in merge_completed(fetch, lookups, sort_key, futures):
+                    events = []
+                    for trip in batch:
+                        flights_found = True
+                        trip_id = dedup_key(trip)
+                        if trip_id in seen_trips:
                             continue
-                    current_date += timedelta(days=1)
-            else:  # return, weekend, or longWeekend flights
-                current_date = start_date
-                weekend_mode = None
-                if data['tripType'] in ['weekend', 'longWeekend']:
-                    weekend_mode = WeekendMode(data['tripType'])
-                
-                # Calculate the latest possible outbound date
-                # It should be end_date minus minimum trip duration
-                latest_outbound_date = end_date - timedelta(days=min_days)
-                
-                while current_date <= latest_outbound_date:
-                    # Skip non-weekend days for weekend trips
-                    if weekend_mode and not is_valid_weekend_day(current_date, weekend_mode, True):
-                        current_date += timedelta(days=1)
+                        seen_trips.add(trip_id)
+                        events.append(sse_event(format_trip(trip, total_passengers)))
+                        if len(events) >= remaining:
+                            break
+                    if not events:
                         continue
+                    yield b"".join(events)
+                    unbilled_events += len(events)
+                    if unbilled_events >= SSE_QUOTA_BATCH:
+                        rate_limited = not consume_event_quota(client, unbilled_events)
+                        unbilled_events = 0
+                        if rate_limited:
+                            break
+                    remaining -= len(events)
+                    if not remaining:
+                        break
 
-                    for origin_code in origin_codes:
-                        try:
-                            trips = api.get_cheapest_return_flights(
-                                origin_code,
-                                current_date,
-                                current_date,
-                                current_date + timedelta(days=min_days),
-                                min(end_date, current_date + timedelta(days=max_days)),
-                                adult_count=int(data['adults']),
-                                teen_count=int(data['teens']),
-                                child_count=int(data['children'])
-                            )
-                            
-                            filtered_trips = [
-                                trip for trip in trips 
-                                if (trip.totalPrice * total_passengers) <= maximum_price 
-                                and any(country in trip.outbound.destinationFull for country in wanted_countries)
-                                and (not weekend_mode or 
-                                     is_valid_weekend_trip(
-                                         trip.outbound.departureTime,
-                                         trip.inbound.departureTime,
-                                         weekend_mode
-                                     ))
-                                and trip.inbound.departureTime.date() <= end_date.date()
-                            ]
-                            
-                            if filtered_trips:
-                                flights_found = True
-                            
-                            for trip in sorted(filtered_trips, key=lambda x: x.totalPrice):
-                                time.sleep(0.01)
-                                flight_json = {
-                                    'outbound': {
-                                        'origin': trip.outbound.origin,
-                                        'originFull': trip.outbound.originFull,
-                                        'destination': trip.outbound.destination,
-                                        'destinationFull': trip.outbound.destinationFull,
-                                        'departureTime': trip.outbound.departureTime.isoformat(),
-                                        'arrivalTime': trip.outbound.arrivalTime.isoformat(),
-                                        'flightDuration': 0,
-                                        #'flightDuration': calculate_duration(trip.outbound.departureTime, trip.outbound.arrivalTime, trip.outbound.origin, trip.outbound.destination),
-                                        'flightNumber': trip.outbound.flightNumber,
-                                        'price': trip.outbound.price,
-                                        'currency': trip.outbound.currency,
-                                        'origin': trip.outbound.origin,
-                                        'originFull': trip.outbound.originFull,
-                                        'destination': trip.outbound.destination,
-                                        'destinationFull': trip.outbound.destinationFull,
-                                    },
-                                    'inbound': {
-                                        'origin': trip.inbound.origin,
-                                        'originFull': trip.inbound.originFull,
-                                        'destination': trip.inbound.destination,
-                                        'destinationFull': trip.inbound.destinationFull,
-                                        'departureTime': trip.inbound.departureTime.isoformat(),
-                                        'arrivalTime': trip.inbound.arrivalTime.isoformat(),
-                                        'flightDuration': 0,
-                                        #'flightDuration': calculate_duration(trip.inbound.departureTime, trip.inbound.arrivalTime, trip.inbound.origin, trip.inbound.destination),
-                                        'flightNumber': trip.inbound.flightNumber,
-                                        'price': trip.inbound.price,
-                                        'currency': trip.inbound.currency,
-                                        'origin': trip.inbound.origin,
-                                        'originFull': trip.inbound.originFull,
-                                        'destination': trip.inbound.destination,
-                                        'destinationFull': trip.inbound.destinationFull,
-                                    },
-                                    'totalPrice': trip.totalPrice * total_passengers
-                                }
-                                yield f"data: {json.dumps(flight_json)}\n\n"
-                        except Exception as e:
-                            logger.error(f"Error fetching flights for {origin_code}: {str(e)}", exc_info=True)
-                            continue
-                    current_date += timedelta(days=1)
-                
-                # Move these outside both search loops
-                if not flights_found:
-                    no_flights_message = {
-                        "type": "NO_FLIGHTS",
-                        "message": "No flights found matching your criteria"
-                    }
-                    yield f"data: {json.dumps(no_flights_message)}\n\n"
+                if rate_limited:
+                    yield SSE_RATE_LIMITED_EVENT
+                elif not flights_found:
+                    yield SSE_NO_FLIGHTS_EVENT
                 
                 # Always send end message
-                yield "data: END\n\n"
+                yield SSE_END_EVENT
+            finally:
+                # Charge whatever was sent since the last full batch
+                if unbilled_events:
+                    consume_event_quota(client, unbilled_events)
+                # Don't keep querying Ryanair for a client that has gone away
+                for future in futures:
+                    future.cancel()
+
+        # A client that has already used up its event quota gets no new search
+        if not limiter.limiter.test(SSE_EVENT_LIMIT, 'sse-events', client):
+            return jsonify({'error': 'Too many results requested, please try again later'}), 429
+
+        stream_token = STREAM_LIMIT.acquire(client)
+        if stream_token is None:
+            return jsonify({'error': 'Too many concurrent searches'}), 429
+
+        headers = {
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'Vary': 'Accept-Encoding'
+        }
+        results = generate_results()
+        if request.accept_encodings['gzip']:
+            results = gzip_stream(results)
+            headers['Content-Encoding'] = 'gzip'
 
+        # Events are already encoded bytes, so hand them to the WSGI server as-is.
+        # direct_passthrough skips Response.close, so the stream slot is given
+        # back by the iterator's close, which runs on completion or disconnect
         return Response(
-            generate_results(),
+            ClosingIterator(
+                stream_with_context(results),
+                lambda: STREAM_LIMIT.release(client, stream_token)
+            ),
             mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': request.headers.get('Origin'),
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            }
+            direct_passthrough=True,
+            headers=headers
         )
 
     except Exception as e:
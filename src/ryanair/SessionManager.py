@@ -1,11 +1,18 @@
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class SessionManager:
     BASE_SITE_FOR_SESSION_URL = "https://www.ryanair.com/ie/en"
+    # Enough pooled keep-alive connections for every lookup running in parallel;
+    # the default of 10 makes urllib3 drop connections once more threads share the session
+    POOL_SIZE = 32
 
     def __init__(self):
         self.session = requests.Session()
+        # Retries stay with the backoff decorator on Ryanair._retryable_query
+        adapter = HTTPAdapter(pool_connections=self.POOL_SIZE, pool_maxsize=self.POOL_SIZE)
+        self.session.mount("https://", adapter)
         self._update_session_cookie()
 
     def _update_session_cookie(self):
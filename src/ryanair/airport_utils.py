@@ -1,13 +1,57 @@
 import os
 import csv
+import json
 from typing import Any, Dict
-from datetime import datetime
-import pytz
-from timezonefinder import TimezoneFinder
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 from .types import Airport
 
 AIRPORTS: Dict[str, Airport] = None
-tf = TimezoneFinder()
+RYANAIR_AIRPORTS: Dict[str, dict] = None
+
+AIRPORTS_CSV_PATH = os.path.join(os.path.dirname(__file__), "airports.csv")
+# Airports from the CSV with their timezones already resolved, written by
+# build_airports.py so startup doesn't have to run TimezoneFinder
+AIRPORTS_INDEX_PATH = os.path.join(os.path.dirname(__file__), "airports_index.json")
+
+_timezone_finder = None
+
+def _find_timezone(lat: float, lng: float):
+    """Look up the timezone at a coordinate, loading TimezoneFinder on first use."""
+    global _timezone_finder
+    if _timezone_finder is None:
+        from timezonefinder import TimezoneFinder
+        _timezone_finder = TimezoneFinder()
+    return _timezone_finder.timezone_at(lat=lat, lng=lng)
+
+def read_airports_csv() -> Dict[str, Airport]:
+    """Build airports from airports.csv, resolving every timezone from its coordinates (slow)."""
+    airports = {}
+    with open(AIRPORTS_CSV_PATH, newline="", encoding="utf8") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            row: dict[str, Any] = row
+
+            iata_code = row["iata_code"]
+            # Most rows are heliports and airfields without an IATA code;
+            # they can't be looked up and would all collide on ""
+            if not iata_code:
+                continue
+            location = ",".join((row["iso_region"], row["iso_country"]))
+            lat = float(row["latitude_deg"])
+            lng = float(row["longitude_deg"])
+            
+            # Find timezone based on coordinates
+            tz_name = _find_timezone(lat, lng)
+
+            airports[iata_code] = Airport(
+                IATA_code=iata_code, 
+                lat=lat, 
+                lng=lng, 
+                location=location,
+                timezone=tz_name
+            )
+    return airports
 
 def load_airports():
     global AIRPORTS
@@ -16,34 +60,43 @@ def load_airports():
 
     AIRPORTS = {}
     try:
-        with open(
-            os.path.join(os.path.dirname(__file__), "airports.csv"),
-            newline="",
-            encoding="utf8",
-        ) as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                row: dict[str, Any] = row
-
-                iata_code = row["iata_code"]
-                location = ",".join((row["iso_region"], row["iso_country"]))
-                lat = float(row["latitude_deg"])
-                lng = float(row["longitude_deg"])
-                
-                # Find timezone based on coordinates
-                timezone = tf.timezone_at(lat=lat, lng=lng)
-
+        with open(AIRPORTS_INDEX_PATH, encoding="utf8") as jsonfile:
+            for iata_code, (lat, lng, location, tz_name) in json.load(jsonfile).items():
                 AIRPORTS[iata_code] = Airport(
-                    IATA_code=iata_code, 
-                    lat=lat, 
-                    lng=lng, 
+                    IATA_code=iata_code,
+                    lat=lat,
+                    lng=lng,
                     location=location,
-                    timezone=timezone
+                    timezone=tz_name
                 )
+    except FileNotFoundError:
+        # No prebuilt index, fall back to resolving timezones from the CSV
+        try:
+            AIRPORTS = read_airports_csv()
+        except Exception as e:
+            print(f"Error loading airports data: {e}")
     except Exception as e:
         print(f"Error loading airports data: {e}")
     return AIRPORTS
 
+def load_ryanair_airports():
+    """Load the airports served by Ryanair (airports.json), keyed by IATA code."""
+    global RYANAIR_AIRPORTS
+    if RYANAIR_AIRPORTS is not None:
+        return RYANAIR_AIRPORTS
+
+    RYANAIR_AIRPORTS = {}
+    try:
+        with open(
+            os.path.join(os.path.dirname(__file__), "airports.json"),
+            encoding="utf8",
+        ) as jsonfile:
+            for airport in json.load(jsonfile):
+                RYANAIR_AIRPORTS[airport["iata_code"]] = airport
+    except Exception as e:
+        print(f"Error loading Ryanair airports data: {e}")
+    return RYANAIR_AIRPORTS
+
 def get_airport_by_iata(iata_code: str):
     """Get airport information by IATA code."""
     global AIRPORTS
@@ -56,8 +109,13 @@ def convert_local_to_utc(local_time: str, airport_code: str) -> datetime:
     local_dt = datetime.fromisoformat(local_time)
     airport = get_airport_by_iata(airport_code)
     if not airport or not airport.timezone:
-        return local_dt.astimezone(pytz.UTC)
-    
-    local_tz = pytz.timezone(airport.timezone)
-    local_dt = local_tz.localize(local_dt)
-    return local_dt.astimezone(pytz.UTC)
+        return local_dt.astimezone(timezone.utc)
+
+    # ZoneInfo caches zones by name, so this doesn't rebuild one per call.
+    # Times around a DST change are read as standard time, as pytz's
+    # localize(is_dst=False) did: fold=1 picks it for the repeated hour in
+    # autumn, fold=0 for the hour skipped in spring
+    local_dt = local_dt.replace(tzinfo=ZoneInfo(airport.timezone), fold=1)
+    if local_dt.utcoffset() > local_dt.replace(fold=0).utcoffset():
+        local_dt = local_dt.replace(fold=0)
+    return local_dt.astimezone(timezone.utc)
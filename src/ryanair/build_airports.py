@@ -0,0 +1,27 @@
+"""
+Rebuild airports_index.json from airports.csv
+
+Resolving the timezone of every airport with TimezoneFinder takes seconds, so
+it is done once here instead of on every worker start. Run from src/ after
+updating airports.csv:
+
+    python -m ryanair.build_airports
+"""
+import json
+
+from ryanair.airport_utils import AIRPORTS_INDEX_PATH, read_airports_csv
+
+
+def main():
+    airports = read_airports_csv()
+    index = {
+        iata_code: [airport.lat, airport.lng, airport.location, airport.timezone]
+        for iata_code, airport in sorted(airports.items())
+    }
+    with open(AIRPORTS_INDEX_PATH, "w", encoding="utf8") as jsonfile:
+        json.dump(index, jsonfile, separators=(",", ":"))
+    print(f"Wrote {len(index)} airports to {AIRPORTS_INDEX_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,16 +14,8 @@ from ryanair.SessionManager import SessionManager
 from ryanair.types import Flight, Trip
 
 logger = logging.getLogger("ryanair")
-if not logger.handlers:
-    logger.setLevel(logging.DEBUG)
-
-    console_handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        "%(asctime)s.%(msecs)03d %(levelname)s:%(message)s", datefmt="%Y-%m-%d %I:%M:%S"
-    )
-
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+# Leave output to the application; records just propagate to its handlers
+logger.addHandler(logging.NullHandler())
 
 
 class RyanairException(Exception):
@@ -176,11 +168,14 @@ class Ryanair:
     )
     def _retryable_query(self, url, params=None):
         self._num_queries += 1
-        trip_type = "return" if "roundTripFares" in url else "one-way"
-        origin = params.get('departureAirportIataCode', 'N/A')
-        date = params.get('outboundDepartureDateFrom', 'N/A')
-        dest = params.get('arrivalCountryCode', 'any')
-        logger.info(f"API#{self._num_queries}: {trip_type} flight {origin} ({date})-> {dest}")
+        logger.info(
+            "API#%d: %s flight %s (%s)-> %s",
+            self._num_queries,
+            "return" if "roundTripFares" in url else "one-way",
+            params.get('departureAirportIataCode', 'N/A'),
+            params.get('outboundDepartureDateFrom', 'N/A'),
+            params.get('arrivalCountryCode', 'any'),
+        )
         response = self.session.get(url, params=params)
         response.raise_for_status()
         return response.json()
@@ -2,16 +2,16 @@ from dataclasses import dataclass
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Airport:
     IATA_code: str
     lat: float
     lng: float
     location: str
-    timezone: str = ""  # Timezone string for pytz
+    timezone: str = ""  # IANA timezone name for zoneinfo
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Flight:
     departureTime: datetime
     arrivalTime: datetime
@@ -24,7 +24,7 @@ class Flight:
     destinationFull: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Trip:
     totalPrice: float
     outbound: Flight
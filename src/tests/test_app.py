@@ -0,0 +1,434 @@
+import datetime
+import json
+import threading
+import time
+import unittest
+import zlib
+from unittest.mock import Mock, patch
+
+from limits import parse as parse_limit
+
+import app
+from app import (
+    AdaptiveConcurrencyLimit,
+    StreamLimit,
+    build_country_filter,
+    parse_search_params,
+)
+from ryanair.types import Flight, Trip
+
+VALID_ONE_WAY_ARGS = {
+    "tripType": "oneWay",
+    "startDate": "2024-06-01",
+    "maxPrice": "100",
+    "originAirports": "DUB,STN",
+    "wantedCountries": "Spain,Morocco",
+    "adults": "1",
+}
+
+VALID_RETURN_ARGS = dict(
+    VALID_ONE_WAY_ARGS,
+    tripType="return",
+    endDate="2024-06-10",
+    minDays="2",
+    maxDays="5",
+)
+
+SEARCH_URL = "/api/search-flights"
+
+
+def with_args(base, **changes):
+    """Copy of base with changes applied; a value of None removes the argument"""
+    args = dict(base, **changes)
+    return {field: value for field, value in args.items() if value is not None}
+
+
+class TestParseSearchParams(unittest.TestCase):
+    def test_valid_one_way(self):
+        params = parse_search_params(VALID_ONE_WAY_ARGS)
+
+        self.assertEqual(params.trip_type, "oneWay")
+        self.assertEqual(params.start_date, datetime.datetime(2024, 6, 1))
+        self.assertEqual(params.max_price, 100.0)
+        self.assertEqual(params.origin_airports, ["DUB", "STN"])
+        self.assertEqual(params.wanted_countries, ["Spain", "Morocco"])
+        self.assertEqual(
+            (params.adults, params.teens, params.children), (1, 0, 0)
+        )
+        self.assertIsNone(params.limit)
+
+    def test_one_way_without_end_date_searches_start_date(self):
+        params = parse_search_params(VALID_ONE_WAY_ARGS)
+
+        self.assertEqual(params.end_date, params.start_date)
+
+    def test_valid_return(self):
+        params = parse_search_params(VALID_RETURN_ARGS)
+
+        self.assertEqual(params.end_date, datetime.datetime(2024, 6, 10))
+        self.assertEqual((params.min_days, params.max_days), (2, 5))
+
+    def test_limit(self):
+        cases = [
+            ("1", 1),
+            ("250", 250),
+            ("", None),
+            (None, None),
+        ]
+        for limit, expected in cases:
+            with self.subTest(limit=limit):
+                args = with_args(VALID_ONE_WAY_ARGS, limit=limit)
+                self.assertEqual(parse_search_params(args).limit, expected)
+
+    def test_invalid_params(self):
+        cases = [
+            ("no origins", with_args(VALID_ONE_WAY_ARGS, originAirports=None),
+             "Missing required field: originAirports"),
+            ("only commas as origins", with_args(VALID_ONE_WAY_ARGS, originAirports=","),
+             "Missing required field: originAirports"),
+            ("no trip type", with_args(VALID_ONE_WAY_ARGS, tripType=None),
+             "Missing required field: tripType"),
+            ("no start date", with_args(VALID_ONE_WAY_ARGS, startDate=None),
+             "Missing required field: startDate"),
+            ("empty max price", with_args(VALID_ONE_WAY_ARGS, maxPrice=""),
+             "Missing required field: maxPrice"),
+            ("no countries", with_args(VALID_ONE_WAY_ARGS, wantedCountries=None),
+             "Missing required field: wantedCountries"),
+            ("no adults", with_args(VALID_ONE_WAY_ARGS, adults=None),
+             "Missing required field: adults"),
+            ("return without end date", with_args(VALID_RETURN_ARGS, endDate=None),
+             "Missing required field: endDate"),
+            ("return without min days", with_args(VALID_RETURN_ARGS, minDays=None),
+             "Missing required field: minDays"),
+            ("return without max days", with_args(VALID_RETURN_ARGS, maxDays=None),
+             "Missing required field: maxDays"),
+            ("unknown trip type", with_args(VALID_RETURN_ARGS, tripType="multiCity"),
+             "Invalid trip type"),
+            ("bad start date", with_args(VALID_ONE_WAY_ARGS, startDate="01/06/2024"),
+             "Invalid date format"),
+            ("impossible end date", with_args(VALID_RETURN_ARGS, endDate="2024-02-30"),
+             "Invalid date format"),
+            ("unknown airport", with_args(VALID_ONE_WAY_ARGS, originAirports="DUB,XXX"),
+             "Invalid airport code"),
+            ("lowercase airport", with_args(VALID_ONE_WAY_ARGS, originAirports="dub"),
+             "Invalid airport code"),
+            ("non-numeric price", with_args(VALID_ONE_WAY_ARGS, maxPrice="cheap"),
+             "Invalid numeric values"),
+            ("fractional adults", with_args(VALID_ONE_WAY_ARGS, adults="1.5"),
+             "Invalid numeric values"),
+            ("negative price", with_args(VALID_ONE_WAY_ARGS, maxPrice="-1"),
+             "Invalid numeric values"),
+            ("zero adults", with_args(VALID_ONE_WAY_ARGS, adults="0"),
+             "Invalid numeric values"),
+            ("negative children", with_args(VALID_ONE_WAY_ARGS, children="-1"),
+             "Invalid numeric values"),
+            ("non-numeric limit", with_args(VALID_ONE_WAY_ARGS, limit="all"),
+             "Invalid numeric values"),
+            ("zero limit", with_args(VALID_ONE_WAY_ARGS, limit="0"),
+             "Invalid numeric values"),
+            ("only commas as countries", with_args(VALID_ONE_WAY_ARGS, wantedCountries=","),
+             "Origin airports and wanted countries cannot be empty"),
+        ]
+        for name, args, message in cases:
+            with self.subTest(name):
+                with self.assertRaises(ValueError) as context:
+                    parse_search_params(args)
+                self.assertEqual(str(context.exception), message)
+
+
+class TestBuildCountryFilter(unittest.TestCase):
+    def test_matches(self):
+        cases = [
+            # Filed under other country names in the bundled index
+            (("Bosnia & Herzegovina",), "BNX", "Banja Luka, Bosnia & Herzegovina", True),
+            (("Morocco",), "VIL", "Dakhla, Morocco", True),
+            # Filed under the same name in the index and at Ryanair
+            (("Bosnia & Herzegovina",), "SJJ", "Sarajevo, Bosnia & Herzegovina", True),
+            (("Morocco",), "RAK", "Marrakesh, Morocco", True),
+            # The index's spelling of a country is accepted too
+            (("Bosnia and Herzegovina",), "BNX", "Banja Luka, Bosnia & Herzegovina", True),
+            # Airports missing from the index fall back to the full name
+            (("Morocco",), "ZZZ", "Nowhere, Morocco", True),
+            (("Morocco",), "ZZZ", "Somewhere in Morocco", True),
+            (("Spain", "Morocco"), "BCN", "Barcelona, Spain", True),
+            (("Morocco",), "BCN", "Barcelona, Spain", False),
+            # Moving VIL to Morocco doesn't make the rest of Morocco Western Sahara
+            (("Western Sahara",), "RAK", "Marrakesh, Morocco", False),
+            (("Morocco",), "ZZZ", "Nowhere, Spain", False),
+        ]
+        for countries, airport_code, full_name, expected in cases:
+            with self.subTest(countries=countries, airport_code=airport_code):
+                matches = build_country_filter(countries)
+                self.assertEqual(matches(airport_code, full_name), expected)
+
+
+class TestStreamLimit(unittest.TestCase):
+    def test_memory_slots_per_client(self):
+        stream_limit = StreamLimit(maximum=2, storage_uri="memory://")
+
+        first = stream_limit.acquire("1.1.1.1")
+        second = stream_limit.acquire("1.1.1.1")
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertNotEqual(first, second)
+        self.assertIsNone(stream_limit.acquire("1.1.1.1"))
+        # Other clients have their own slots
+        self.assertIsNotNone(stream_limit.acquire("2.2.2.2"))
+
+        stream_limit.release("1.1.1.1", first)
+        self.assertIsNotNone(stream_limit.acquire("1.1.1.1"))
+
+    def test_memory_released_client_gets_every_slot_back(self):
+        stream_limit = StreamLimit(maximum=2, storage_uri="memory://")
+
+        for token in [stream_limit.acquire("1.1.1.1") for _ in range(2)]:
+            stream_limit.release("1.1.1.1", token)
+
+        self.assertIsNotNone(stream_limit.acquire("1.1.1.1"))
+        self.assertIsNotNone(stream_limit.acquire("1.1.1.1"))
+        self.assertIsNone(stream_limit.acquire("1.1.1.1"))
+
+
+class TestAdaptiveConcurrencyLimit(unittest.TestCase):
+    def test_throttling_halves_limit(self):
+        limit = AdaptiveConcurrencyLimit(initial=8, maximum=16)
+
+        limit.acquire()
+        limit.release(throttled=True)
+
+        self.assertEqual(limit.limit, 4)
+
+    def test_throttling_stops_at_minimum(self):
+        limit = AdaptiveConcurrencyLimit(initial=3, maximum=16, minimum=2)
+
+        for _ in range(3):
+            limit.acquire()
+            limit.release(throttled=True)
+
+        self.assertEqual(limit.limit, 2)
+
+    def test_grows_after_full_window_of_successes(self):
+        limit = AdaptiveConcurrencyLimit(initial=4, maximum=16)
+
+        for _ in range(3):
+            limit.acquire()
+            limit.release()
+        self.assertEqual(limit.limit, 4)
+
+        limit.acquire()
+        limit.release()
+        self.assertEqual(limit.limit, 5)
+
+    def test_grows_no_further_than_maximum(self):
+        limit = AdaptiveConcurrencyLimit(initial=2, maximum=3)
+
+        for _ in range(20):
+            limit.acquire()
+            limit.release()
+
+        self.assertEqual(limit.limit, 3)
+
+    def test_acquire_blocks_once_limit_is_in_flight(self):
+        limit = AdaptiveConcurrencyLimit(initial=2, maximum=4)
+        limit.acquire()
+        limit.acquire()
+
+        waiter = threading.Thread(target=limit.acquire)
+        waiter.start()
+        waiter.join(timeout=0.1)
+        self.assertTrue(waiter.is_alive())
+
+        limit.release()
+        waiter.join(timeout=1)
+        self.assertFalse(waiter.is_alive())
+
+
+def make_flight(origin, destination, departure, price):
+    return Flight(
+        departureTime=departure,
+        arrivalTime=departure + datetime.timedelta(hours=2),
+        flightNumber="FR 1",
+        price=price,
+        currency="EUR",
+        origin=origin,
+        originFull="Dublin, Ireland" if origin == "DUB" else "Barcelona, Spain",
+        destination=destination,
+        destinationFull="Barcelona, Spain" if destination == "BCN" else "Dublin, Ireland",
+    )
+
+
+def make_trip(departure, price):
+    outbound = make_flight("DUB", "BCN", departure, price)
+    inbound = make_flight("BCN", "DUB", departure + datetime.timedelta(days=2), price)
+    return Trip(totalPrice=price * 2, outbound=outbound, inbound=inbound)
+
+
+def read_events(body):
+    """Decode an SSE body into its payloads, with END as a plain string"""
+    events = []
+    for event in body.decode().split("\n\n"):
+        if event:
+            data = event[len("data: "):]
+            events.append(data if data == "END" else json.loads(data))
+    return events
+
+
+class TestSearchStream(unittest.TestCase):
+    def setUp(self):
+        self.api = Mock()
+        self.api.get_cheapest_flights.return_value = []
+        self.api.get_cheapest_return_flights.return_value = []
+        get_api_patcher = patch.object(app, "get_api", return_value=self.api)
+        get_api_patcher.start()
+        self.addCleanup(get_api_patcher.stop)
+
+        stream_limit_patcher = patch.object(
+            app, "STREAM_LIMIT", StreamLimit(maximum=1, storage_uri="memory://")
+        )
+        stream_limit_patcher.start()
+        self.addCleanup(stream_limit_patcher.stop)
+
+        app.TRIP_CACHE.clear()
+        app.limiter.reset()
+        self.client = app.app.test_client()
+
+    def open_search(self, base=VALID_ONE_WAY_ARGS, headers=None, **changes):
+        """Start a search without reading or closing its stream"""
+        args = with_args(base, wantedCountries="Spain", originAirports="DUB", **changes)
+        return self.client.get(SEARCH_URL, query_string=args, headers=headers, buffered=False)
+
+    def search(self, base=VALID_ONE_WAY_ARGS, **changes):
+        """Run a search to the end, returning its response with the body read"""
+        response = self.open_search(base, **changes)
+        response.get_data()
+        response.close()
+        return response
+
+    def test_one_way_sends_matches_in_price_order(self):
+        departure = datetime.datetime(2024, 6, 1, 8)
+        self.api.get_cheapest_flights.return_value = [
+            make_flight("DUB", "BCN", departure, 30.0),
+            make_flight("DUB", "BCN", departure.replace(hour=12), 10.0),
+            make_flight("DUB", "BCN", departure.replace(hour=18), 500.0),
+        ]
+
+        response = self.search()
+
+        events = read_events(response.get_data())
+        self.assertEqual([event["totalPrice"] for event in events[:-1]], [10.0, 30.0])
+        self.assertEqual(events[-1], "END")
+
+    def test_no_matches_sends_no_flights_then_end(self):
+        for base in (VALID_ONE_WAY_ARGS, VALID_RETURN_ARGS):
+            with self.subTest(trip_type=base["tripType"]):
+                events = read_events(self.search(base).get_data())
+
+                self.assertEqual(events[0]["type"], "NO_FLIGHTS")
+                self.assertEqual(events[1:], ["END"])
+
+    def test_limit_stops_stream_and_lookups(self):
+        started = threading.Event()
+        def get_cheapest_flights(origin, date_from, date_to, **kwargs):
+            if started.is_set():
+                time.sleep(0.05)
+                return []
+            started.set()
+            return [
+                make_flight("DUB", "BCN", datetime.datetime.combine(date_from, datetime.time(hour)), price)
+                for hour, price in ((8, 10.0), (12, 20.0), (18, 30.0))
+            ]
+        self.api.get_cheapest_flights.side_effect = get_cheapest_flights
+
+        response = self.search(endDate="2024-07-30", limit="2")
+
+        events = read_events(response.get_data())
+        self.assertEqual([event["totalPrice"] for event in events[:-1]], [10.0, 20.0])
+        self.assertEqual(events[-1], "END")
+        # Only the first window of the 60 days was ever looked up
+        time.sleep(0.1)
+        self.assertLessEqual(self.api.get_cheapest_flights.call_count, app.LOOKUPS_PER_SEARCH + 1)
+
+    def test_lookups_in_flight_stay_within_window(self):
+        lock = threading.Lock()
+        in_flight = peak = 0
+        def get_cheapest_flights(*args, **kwargs):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.01)
+            with lock:
+                in_flight -= 1
+            return []
+        self.api.get_cheapest_flights.side_effect = get_cheapest_flights
+
+        with patch.object(app, "LOOKUPS_PER_SEARCH", 3):
+            self.search(endDate="2024-06-20").get_data()
+
+        self.assertEqual(self.api.get_cheapest_flights.call_count, 20)
+        self.assertLessEqual(peak, 3)
+
+    def test_return_trip_found_for_several_days_is_sent_once(self):
+        # Every outbound day's lookup returns the same trip
+        self.api.get_cheapest_return_flights.return_value = [
+            make_trip(datetime.datetime(2024, 6, 3, 8), 20.0)
+        ]
+
+        events = read_events(self.search(VALID_RETURN_ARGS).get_data())
+
+        self.assertGreater(self.api.get_cheapest_return_flights.call_count, 1)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[0]["totalPrice"], 40.0)
+        self.assertEqual(events[1], "END")
+
+    def test_event_quota_ends_stream_then_refuses_searches(self):
+        departure = datetime.datetime(2024, 6, 1, 8)
+        self.api.get_cheapest_flights.return_value = [
+            make_flight("DUB", "BCN", departure, 10.0),
+            make_flight("DUB", "BCN", departure.replace(hour=12), 20.0),
+        ]
+
+        with patch.object(app, "SSE_EVENT_LIMIT", parse_limit("3 per hour")), \
+                patch.object(app, "SSE_QUOTA_BATCH", 1):
+            first = read_events(self.search().get_data())
+            second = read_events(self.search().get_data())
+            third = self.search()
+
+        self.assertEqual(first[-1], "END")
+        self.assertEqual(second[-2]["type"], "RATE_LIMITED")
+        self.assertEqual(second[-1], "END")
+        self.assertEqual(third.status_code, 429)
+
+    def test_gzip_chunks_decode_to_whole_events(self):
+        departure = datetime.datetime(2024, 6, 1, 8)
+        self.api.get_cheapest_flights.return_value = [
+            make_flight("DUB", "BCN", departure, 10.0)
+        ]
+
+        response = self.open_search(endDate="2024-06-03", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+        decompressor = zlib.decompressobj(31)
+        body = b""
+        for chunk in response.response:
+            body += decompressor.decompress(chunk)
+            self.assertTrue(body.endswith(b"\n\n"))
+        response.close()
+
+        events = read_events(body)
+        self.assertEqual(events[0]["totalPrice"], 10.0)
+        self.assertEqual(events[-1], "END")
+
+    def test_stream_slot_freed_when_response_closes(self):
+        open_stream = self.open_search()
+        refused = self.search()
+        open_stream.close()
+        allowed = self.search()
+
+        self.assertEqual(open_stream.status_code, 200)
+        self.assertEqual(refused.status_code, 429)
+        self.assertEqual(allowed.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,8 @@ from unittest.mock import patch, Mock, call
 import requests
 
 from ryanair import Ryanair
+from ryanair.airport_utils import convert_local_to_utc
+from ryanair.SessionManager import SessionManager
 from ryanair.types import Flight, Trip
 
 MOCKED_ONE_WAY_RESPONSE = {
@@ -750,6 +752,28 @@ class TestRyanair(unittest.TestCase):
             any_order=True,
         )
 
+    @patch("ryanair.SessionManager.SessionManager._update_session_cookie")
+    def test_session_pool_fits_parallel_queries(self, _mock_update_session_cookie):
+        session = SessionManager().get_session()
+        adapter = session.get_adapter("https://www.ryanair.com/api")
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], SessionManager.POOL_SIZE)
+
+
+class TestConvertLocalToUtc(unittest.TestCase):
+    def test_daylight_saving_changes_read_as_standard_time(self):
+        utc = datetime.timezone.utc
+        cases = [
+            ("2024-01-15T10:00:00", datetime.datetime(2024, 1, 15, 9, 0, tzinfo=utc)),
+            ("2024-07-15T10:00:00", datetime.datetime(2024, 7, 15, 8, 0, tzinfo=utc)),
+            # Skipped when clocks go forward
+            ("2024-03-31T02:30:00", datetime.datetime(2024, 3, 31, 1, 30, tzinfo=utc)),
+            # Happens twice when clocks go back
+            ("2024-10-27T02:30:00", datetime.datetime(2024, 10, 27, 1, 30, tzinfo=utc)),
+        ]
+        for local_time, expected in cases:
+            with self.subTest(local_time=local_time):
+                self.assertEqual(convert_local_to_utc(local_time, "MAD"), expected)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,10 @@
+# Make sockets, threads and locks cooperative before anything imports them.
+# Gunicorn's gevent worker patches too; doing it here keeps the app consistent
+# when wsgi.py is run directly
+from gevent import monkey
+monkey.patch_all()
+
 from app import app
 
 if __name__ == "__main__":
-    app.run() 
\ No newline at end of file
+    app.run() 